@@ -9,11 +9,10 @@ Implementation of CloudInitDoc, a container that can render cloud-init
 user-data documents that are single-part or multi-part.
 """
 
-from base64 import b64encode
-from typing import Optional, List, Union
-
-from io import BytesIO
-import gzip
+from typing import Optional, List, Set, Tuple, Union, Callable
+from types import ModuleType
+from functools import lru_cache
+import re
 
 from .typehints import JsonableDict
 from .exceptions import CloudInitGenError
@@ -29,6 +28,75 @@ GZIP_FIXED_MTIME: float = 0.0
    This makes the rendered data deterministic and stable, which helps keep infrastructure
    automation tools like terraform and Pulumi from needlessly updating cloud instances. """
 
+GZIP_USE_ISAL: bool = False
+"""If True, ISA-L (the isal package, installed with the "accel" extra) is used to GZIP large
+   documents instead of the standard library, which is much faster. The compressed bytes differ
+   from the standard library's, and may differ between isal versions, so enabling this changes
+   the rendered binary of large documents; it is off by default so that rendered output stays
+   stable wherever the package is installed. """
+
+# NOTE: compression and base-64 support is imported on first use rather than at module load, so
+# that importing the package (e.g., just to render text) does not pay for it.
+
+@lru_cache(maxsize=None)
+def _get_isal_igzip() -> ModuleType:
+  """Returns the isal.igzip module.
+
+  Raises:
+      CloudInitGenError: GZIP_USE_ISAL is True but ISA-L is not installed
+  """
+  try:
+    # ISA-L's SIMD-accelerated DEFLATE is several times faster than zlib, at a comparable
+    # compression ratio.
+    from isal import igzip
+  except ImportError as e:
+    raise CloudInitGenError("GZIP_USE_ISAL is set, but the isal package is not installed") from e
+  return igzip
+
+@lru_cache(maxsize=None)
+def _get_b64encode() -> Callable[[bytes], bytes]:
+  """Returns pybase64's b64encode if it is installed; otherwise the standard library's."""
+  try:
+    # pybase64 uses a SIMD (AVX2/AVX-512/NEON) codec, and falls back to scalar code on older hardware
+    from pybase64 import b64encode
+  except ImportError:
+    from base64 import b64encode # type: ignore[assignment]
+  return b64encode
+
+def _gzip_compress(data: bytes, mtime: float, use_isal: bool=False) -> bytes:
+  """Compresses a complete buffer with GZIP, using a fixed timestamp.
+
+  By default, the output is identical to the standard gzip module's at level 9. If use_isal
+  is True, ISA-L is used at its best compression level (3) instead. Either way, the result is
+  deterministic for a given input.
+
+  Args:
+      data (bytes): The uncompressed data
+      mtime (float): The timestamp to record in the GZIP header; normally GZIP_FIXED_MTIME
+      use_isal (bool, optional): True to compress with ISA-L. Defaults to False.
+
+  Returns:
+      bytes: The GZIP-compressed data
+
+  Raises:
+      CloudInitGenError: use_isal is True but ISA-L is not installed
+  """
+  if use_isal:
+    # One-shot compression sizes the output buffer up front, instead of growing it as it is written
+    return _get_isal_igzip().compress(data, compresslevel=3, mtime=mtime)
+  # Assemble the GZIP stream directly around a raw DEFLATE stream rather than going through
+  # gzip.GzipFile. The header matches GzipFile's exactly: no flags, fixed mtime, XFL=2 (maximum
+  # compression) and OS=255 (unknown).
+  import struct
+  import zlib
+  header = b'\x1f\x8b\x08\x00' + struct.pack('<L', int(mtime)) + b'\x02\xff'
+  compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+  body = compressor.compress(data) + compressor.flush()
+  trailer = struct.pack('<LL', zlib.crc32(data), len(data) & 0xffffffff)
+  return header + body + trailer
+
+_BOUNDARY_NUMBER_PATTERN = re.compile(r'(?=::(\d+)::)')
+"""Matches the number in every (possibly overlapping) occurrence of a '::<number>::' candidate boundary string"""
 
 CloudInitDocConvertible = Optional[
           Union[
@@ -47,6 +115,8 @@ class CloudInitDoc(CloudInitRenderable):
   be passed directly to cloud-init.
   """
 
+  __slots__ = ('parts', 'raw_binary', '_compressed_cache')
+
   parts: List[CloudInitRenderable]
   """If raw_binary is None, a List of renderable parts to be rendered. An empty list
      indicates an empty/null user-data document. A list with a single item
@@ -54,17 +124,26 @@ class CloudInitDoc(CloudInitRenderable):
      one item is rendered as a multipart MIME document.  Ignored if
      raw_binary is not None."""
 
-  raw_binary: Optional[bytes]=None
+  raw_binary: Optional[bytes]
   """If not None, a raw binary encoding of the entire user-data document,
      which can be passed directly to cloud-init. This field exists only
      so that users can choose to render user-data themselves, and still
      pass the result to an API that expects CloudInitDoc."""
 
+  _compressed_cache: Optional[Tuple[bool, float, bytes, bytes]]
+  """The most recent (use_isal, mtime, uncompressed, compressed) tuple produced by render_binary(), or None.
+     Rendering text is cheap once parts are built, but GZIP is not, so repeated binary or
+     base-64 renders of an unchanged document reuse the compressed result. The cache is
+     keyed on the uncompressed bytes rather than invalidated by add(), because parts (and
+     nested documents) can be modified after they are added, and on the GZIP_USE_ISAL and
+     GZIP_FIXED_MTIME settings in effect, because they can be changed between renders."""
+
   def __init__(
         self,
         content: CloudInitDocConvertible=None,
         mime_type: Optional[str]=None,
-        headers: MimeHeadersConvertible=None
+        headers: MimeHeadersConvertible=None,
+        prefer_json: bool=False
       ):
     """Create a container for a complete cloud-init user-data document,
        which may consist of zero or more CloudInnitDataPart's, or can
@@ -85,26 +164,31 @@ class CloudInitDoc(CloudInitRenderable):
            If content is not None and not bytes, as described for add(). Ignored if content is None. Defaults to None.
         headers (MimeHeadersConvertible, optional):
            If content is not None and not bytes, as described for add(). Ignored if content is None. Defaults to None.
+        prefer_json (bool, optional):
+           If content is not None and not bytes, as described for add(). Ignored if content is None. Defaults to False.
 
     Raises:
         CloudInitGenError: An error occured building the first part of the document.
     """
     self.parts = []
-    if not content is None:
+    self.raw_binary = None
+    self._compressed_cache = None
+    if content is not None:
       if isinstance(content, CloudInitDoc):
         self.parts = content.parts[:]
         self.raw_binary = content.raw_binary
       elif isinstance(content, bytes):
-        if len(content) > 16383:
-          raise CloudInitGenError(f"raw binary user data too big: {len(content)}")
+        if (content_len := len(content)) > 16383:
+          raise CloudInitGenError(f"raw binary user data too big: {content_len}")
         self.raw_binary = content
       else:
-        self.add(content, mime_type=mime_type, headers=headers)
+        self.add(content, mime_type=mime_type, headers=headers, prefer_json=prefer_json)
 
   def add(self,
         content: Union[CloudInitRenderable, CloudInitPartConvertible],
         mime_type: Optional[str]=None,
-        headers: MimeHeadersConvertible=None
+        headers: MimeHeadersConvertible=None,
+        prefer_json: bool=False
       ):
     """Add a single renderable part of a potentially multi-part cloud-init document.
 
@@ -142,15 +226,20 @@ class CloudInitDoc(CloudInitRenderable):
                             rendering is selected. If comment-header rendering is selected, the headers are
                             discarded. Defaults to None.
 
+        prefer_json (bool, optional):
+                            If True and content is a JsonableDict that will have MIME type "text/cloud-config",
+                            the dict is rendered as compact JSON rather than YAML, as described for
+                            CloudInitPart. Ignored if content is already a CloudInitRenderable. Defaults to False.
+
     Raises:
         CloudInitGenError: An attempt was made to add a part to a document that was created with raw_binary
         CloudInitGenError: An error occured building the part
     """
-    if not content is None:
-      if not self.raw_binary is None:
+    if content is not None:
+      if self.raw_binary is not None:
         raise CloudInitGenError(f"Cannot add parts to CloudInitDoc initialized with raw binary payload")
       if not isinstance(content, CloudInitRenderable):
-        content = CloudInitPart(content, mime_type=mime_type, headers=headers)
+        content = CloudInitPart(content, mime_type=mime_type, headers=headers, prefer_json=prefer_json)
       if not content.is_null_content():
         self.parts.append(content)
 
@@ -198,41 +287,61 @@ class CloudInitDoc(CloudInitRenderable):
     """
     result: Optional[str]
     if self.raw_binary is None:
-      if not len(self.parts) > 0 and not include_mime_version:
+      parts = self.parts
+      if not len(parts) > 0 and not include_mime_version:
         raise CloudInitGenError("include_mime_version MUST be True for the outermost cloud_init_data part")
-      if len(self.parts) == 0:
+      if len(parts) == 0:
         result = None
-      elif len(self.parts) == 1:
-        result = self.parts[0].render(include_mime_version=include_mime_version, force_mime=force_mime)
+      elif len(parts) == 1:
+        result = parts[0].render(include_mime_version=include_mime_version, force_mime=force_mime)
       else:
-        # Parts of a multi-part document are forced into MIME mode
-        rendered_parts = [ part.render(force_mime=True, include_mime_version=False) for part in self.parts ]
-
-        # Find a unique boundary string that is not in any of the rendered parts
+        # Parts of a multi-part document are forced into MIME mode. We need a boundary
+        # string that is not in any of the rendered parts; rather than searching every part
+        # for each candidate, collect every '::N::' candidate already present as each part
+        # is rendered, then pick the lowest-numbered one that isn't.
+        rendered_parts: List[str] = []
+        used_numbers: Set[str] = set()
+        find_numbers = _BOUNDARY_NUMBER_PATTERN.findall
+        for part in parts:
+          rp = part.render(force_mime=True, include_mime_version=False)
+          assert rp is not None
+          rendered_parts.append(rp)
+          used_numbers.update(find_numbers(rp))
         unique = 0
-
-        while True:
-          boundary = f'::{unique}::'
-          for rp in rendered_parts:
-            assert not rp is None
-            if boundary in rp:
-              break
-          else:
-            break
+        while str(unique) in used_numbers:
           unique += 1
-        
-        result = f'Content-Type: multipart/mixed; boundary="{boundary}"\n'
+        boundary = f'::{unique}::'
+
+        chunks: List[str] = [ f'Content-Type: multipart/mixed; boundary="{boundary}"\n' ]
         if include_mime_version:
-          result += 'MIME-Version: 1.0\n'
-        result += '\n'
+          chunks.append('MIME-Version: 1.0\n')
+        chunks.append('\n')
+        delimiter = f"--{boundary}\n"
         for rp in rendered_parts:
-          result += f"--{boundary}\n{rp}\n"
-        result += f"--{boundary}--\n"
+          chunks.extend((delimiter, rp, '\n'))
+        chunks.append(f"--{boundary}--\n")
+        result = ''.join(chunks)
     else:
       result = self.raw_binary.decode('utf-8')
 
     return result
 
+  def _render_bytes(self, include_mime_version: bool=True) -> Optional[bytes]:
+    """Renders the parts of the cloudinit user-data document to uncompressed UTF-8 bytes.
+       Must only be called if raw_binary is None.
+
+    Args:
+        include_mime_version (bool, optional):
+                        True if a MIME-Version header should be included.
+                        See render(). Defaults to True.
+
+    Returns:
+        Optional[bytes]: The uncompressed UTF-8 encoding of the document, or None if this
+                       is a null/empty document (with zero parts).
+    """
+    content = self.render(include_mime_version=include_mime_version)
+    return None if content is None else content.encode('utf-8')
+
   def render_binary(self, include_mime_version: bool=True) -> Optional[bytes]:
     """Renders the entire cloudinit user-data document to a binary bytes buffer suitable for passing
        to cloud-init directly. For single-part documents, renders them directly. For
@@ -258,18 +367,23 @@ class CloudInitDoc(CloudInitRenderable):
                        is directly returned.
     """
     if self.raw_binary is None:
-      content = self.render(include_mime_version=include_mime_version)
-      bcontent = None if content is None else content.encode('utf-8')
-      if not bcontent is None and len(bcontent) >= 16383:
-        buff = BytesIO()
+      bcontent = self._render_bytes(include_mime_version=include_mime_version)
+      # Only compress when the document would not otherwise fit; nearly all documents are
+      # small enough to skip compression entirely.
+      if bcontent is not None and (blen := len(bcontent)) > 16383:
         # NOTE: we use a fixed modification time when zipping so that the resulting compressed data is
         # always the same for a given input. This prevents Pulumi from unnecessarily replacing EC2 instances
         # because it looks like the cloud-init user-data changed when it really did not.
-        with gzip.GzipFile(None, 'wb', compresslevel=9, fileobj=buff, mtime=GZIP_FIXED_MTIME) as g:
-          g.write(bcontent)
-        compressed = buff.getvalue()
+        use_isal = GZIP_USE_ISAL
+        mtime = GZIP_FIXED_MTIME
+        cached = self._compressed_cache
+        if cached is not None and cached[0] == use_isal and cached[1] == mtime and cached[2] == bcontent:
+          compressed = cached[3]
+        else:
+          compressed = _gzip_compress(bcontent, mtime, use_isal=use_isal)
+          self._compressed_cache = (use_isal, mtime, bcontent, compressed)
         if len(compressed) > 16383:
-          raise CloudInitGenError(f"EC2 cloud_init_data too big: {len(bcontent)} before compression, {len(compressed)} after")
+          raise CloudInitGenError(f"EC2 cloud_init_data too big: {blen} before compression, {len(compressed)} after")
         bcontent = compressed
     else:
       bcontent = self.raw_binary
@@ -299,6 +413,30 @@ class CloudInitDoc(CloudInitRenderable):
                        document (with zero parts). If raw_binary was provided at construction
                        time, then that value is simply encoded with base-64.
     """
-    bcontent = self.render_binary(include_mime_version=include_mime_version)
-    b64 = None if bcontent is None else b64encode(bcontent).decode('utf-8')
+    b64_bytes = self.render_base64_bytes(include_mime_version=include_mime_version)
+    # base-64 output is pure ASCII, which decodes faster than UTF-8
+    b64 = None if b64_bytes is None else b64_bytes.decode('ascii')
     return b64
+
+  def render_base64_bytes(self, include_mime_version: bool=True) -> Optional[bytes]:
+    """Renders the entire cloudinit user-data document to a base-64 encoded binary block, as ASCII bytes.
+       Equivalent to render_base64(), but avoids decoding the result to a str, for APIs
+       that accept bytes.
+
+    Args:
+        include_mime_version (bool, optional):
+                        True if a MIME-Version header should be included.
+                        Ignored if a single-part document and comment-style
+                        headers are selected. Note that cloud-init REQUIRES
+                        this header for the outermost MIME document, so for
+                        compatibility it should be left at True. Defaults to True.
+
+    Returns:
+        Optional[bytes]: The entire document rendered as a base-64 encoded binary block, as
+                       ASCII bytes, or None if this is a null/empty document (with zero parts).
+                       If raw_binary was provided at construction time, then that value is
+                       simply encoded with base-64.
+    """
+    bcontent = self.render_binary(include_mime_version=include_mime_version)
+    b64_bytes = None if bcontent is None else _get_b64encode()(bcontent)
+    return b64_bytes
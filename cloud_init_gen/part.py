@@ -8,17 +8,17 @@
 Implementation of CloudDataPart, a container for a single
 part of a potentially multi-part cloud-init user-data document.
 """
-from typing import Optional, Union, Tuple, Dict, OrderedDict, Iterable, cast
+from typing import Optional, Union, Tuple, Dict, OrderedDict, Iterable, List, cast
 
-from base64 import b64encode
+from functools import partial
+import re
 import yaml
-import email.parser
-from collections import OrderedDict as ordereddict
 
 from .typehints import JsonableDict
 from .exceptions import CloudInitGenError
 
 from .part_type import (
+    CloudInitPartType,
     mime_to_cloud_init_part_type,
     comment_to_cloud_init_part_type
   )
@@ -26,22 +26,147 @@ from .part_type import (
 from .renderable import CloudInitRenderable
 
 MimeHeadersConvertible = Optional[Union[Dict[str, str], Iterable[Tuple[str, str]], OrderedDict[str, str]]]
-"""Type hint for value that can be converted to an OrderedDict of MIME headers"""
+"""Type hint for value that can be converted to an ordered dict of MIME headers"""
 
 CloudInitPartConvertible = Optional[Union[str, JsonableDict, 'CloudInitPart']]
 """Type hint for values that can be used as initialization content for a CloudInitPart"""
 
-def _normalize_headers(headers:  MimeHeadersConvertible) -> OrderedDict[str, str]:
-  result: Optional[OrderedDict[str, str]]
+try:
+  # libyaml's C emitter is many times faster than the pure-Python one. Its output loads to the same
+  # data, but is not always byte-identical; e.g., {'': ['a']} is emitted as "'': [a]" by libyaml and
+  # as "? ''\n: [a]" by the pure-Python emitter.
+  from yaml import CSafeDumper as _SafeDumper
+except ImportError:
+  from yaml import SafeDumper as _SafeDumper # type: ignore[assignment]
+
+_yaml_dump = partial(
+    yaml.dump,
+    Dumper=_SafeDumper,
+    sort_keys=True,
+    indent=1,
+    default_flow_style=None,
+    width=10000,
+  )
+"""Renders a JsonableDict as YAML, in the format used for cloud-config parts"""
+
+_JSON_SURROGATE_PAIR_PATTERN = re.compile(r'(?<!\\)((?:\\\\)*)\\u(d[89ab][0-9a-f]{2})\\u(d[c-f][0-9a-f]{2})')
+"""Matches a JSON "\\uXXXX\\uXXXX" surrogate pair escape that is not itself escaped by a preceding backslash"""
+
+def _yaml_astral_escape(match: 're.Match[str]') -> str:
+  code_point = 0x10000 + ((int(match.group(2), 16) - 0xd800) << 10) + (int(match.group(3), 16) - 0xdc00)
+  return '%s\\U%08x' % (match.group(1), code_point)
+
+_JSON_EXPONENT_FLOAT_PATTERN = re.compile(r'("(?:[^"\\]|\\.)*")|(?<![\d.])(-?\d+)(e[-+]\d+)')
+"""Matches a JSON string (group 1, left alone), or a float written in exponent form without a
+   fractional part (groups 2 and 3), as json.dumps writes e.g. 1e-05"""
+
+def _yaml_exponent_float(match: 're.Match[str]') -> str:
+  string = match.group(1)
+  return string if string is not None else '%s.0%s' % (match.group(2), match.group(3))
+
+def _json_dump(content: JsonableDict) -> str:
+  """Renders a JsonableDict as compact JSON with sorted keys, adjusted where needed so that
+     YAML 1.1 (which cloud-init's PyYAML loader follows) reads it back as the same data.
+
+     JSON is not quite a subset of YAML 1.1:
+       - json.dumps escapes characters outside the BMP as UTF-16 surrogate pairs, which YAML
+         decodes as two separate (invalid) characters, so those are rewritten as YAML's 8-digit
+         "\\UXXXXXXXX" escape. ensure_ascii is left on because YAML does not accept some raw
+         non-ASCII characters (e.g., U+0085) inside double-quoted scalars.
+       - YAML 1.1 floats need a ".", so exponent-form floats such as 1e-05 (which would load as
+         strings) are rewritten as 1.0e-05.
+       - JSON has no representation for infinity or NaN, so content containing them is rendered
+         as YAML instead.
+  """
+  import json   # Deferred; JSON rendering is opt-in
+  try:
+    result = json.dumps(content, sort_keys=True, separators=(',', ':'), allow_nan=False)
+  except ValueError:
+    return cast(str, _yaml_dump(content))
+  if '\\ud' in result:
+    result = _JSON_SURROGATE_PAIR_PATTERN.sub(_yaml_astral_escape, result)
+  if 'e-' in result or 'e+' in result:
+    result = _JSON_EXPONENT_FLOAT_PATTERN.sub(_yaml_exponent_float, result)
+  return result + '\n'
+
+_SHEBANG_PART_TYPE = comment_to_cloud_init_part_type['#!']
+"""The part type identified by a shebang ("#!...") comment line, whatever the rest of the line is"""
+
+_SHELLSCRIPT_MIME_TYPES = frozenset([
+    'text/x-shellscript',
+    'text/x-shellscript-per-boot',
+    'text/x-shellscript-per-instance',
+    'text/x-shellscript-per-once',
+  ])
+"""MIME types of shell script parts, which must begin with a shebang line"""
+
+def _normalize_headers(headers:  MimeHeadersConvertible) -> Dict[str, str]:
+  # NOTE: builtin dicts preserve insertion order, so there is no need for the heavier OrderedDict
+  result: Dict[str, str]
   if headers is None:
-    result = ordereddict()
+    result = {}
   else:
-    result = ordereddict(headers)
+    result = dict(headers)
   return result
 
+_HEADER_NAME_PATTERN = re.compile(r'[\041-\071\073-\176]+')
+"""Matches a well-formed MIME header field name (printable ASCII other than space and ':')"""
+
+def _split_simple_mime_headers(content: str) -> Optional[Tuple[str, Dict[str, str]]]:
+  """Splits the headers from the payload of a simple, well-formed MIME document without
+     using the email package.
+
+  Only documents whose headers are LF-terminated, well-formed "Name: value" lines (with
+  optional folded continuation lines), followed by a blank line, are handled. The result
+  is identical to what email.parser would produce for such documents. Anything else
+  returns None, and should be parsed with email.parser instead.
+
+  Args:
+      content (str): MIME document to be parsed
+
+  Returns:
+      Optional[Tuple[str, Dict[str, str]]]: None if the document is not simple; otherwise,
+         a tuple containing:
+            [0]: The document payload
+            [1]: an ordered dict containing the headers. As with email.parser, the first
+                 occurrence of a repeated header wins.
+  """
+  head, sep, payload = content.partition('\n\n')
+  if sep == '' or '\r' in head:
+    return None
+  fields: List[List[str]] = []
+  for line in head.split('\n'):
+    if line.startswith((' ', '\t')):
+      if len(fields) == 0:
+        return None
+      fields[-1][1] += '\n' + line
+    else:
+      name, colon, value = line.partition(':')
+      if colon == '' or _HEADER_NAME_PATTERN.fullmatch(name) is None:
+        return None
+      fields.append([name, value.lstrip(' \t')])
+  headers: Dict[str, str] = {}
+  names_by_lower: Dict[str, str] = {}
+  for name, value in fields:
+    if names_by_lower.setdefault(name.lower(), name) != name:
+      # The same header with different capitalizations; leave it to email.parser
+      return None
+    headers.setdefault(name, value)
+  return payload, headers
+
 class CloudInitPart(CloudInitRenderable):
   """A container for a single part of a potentially multi-part cloud-init document"""
 
+  __slots__ = (
+      'content',
+      'mime_type',
+      'mime_version',
+      'comment_line',
+      'comment_type',
+      'comment_line_included',
+      'headers',
+    )
+
   content: Optional[str]
   """The string representation of the part's content, which is interpreted differently depending
      on its type, or None if this is a "null" part, which will be stripped from the
@@ -53,25 +178,25 @@ class CloudInitPart(CloudInitRenderable):
   mime_type: str
   """The full MIME type of the part; e.g., "text/cloud-config". """
 
-  mime_version: Optional[str] = None
+  mime_version: Optional[str]
   """The MIME version, as pulled from the MIME-Version header. If None, "1.0" is assumed."""
 
-  comment_line: Optional[str] = None
+  comment_line: Optional[str]
   """The full comment line associated with the part. For shebang-style parts this is
      the entire shebang line; e.g., "#!/bin/bash". If None, there is not comment header
      associated with the part's MIME type. If comment_line_included is true, then this line is also
      present in content; otherwise it has been stripped from content."""
 
-  comment_type: Optional[str] = None
+  comment_type: Optional[str]
   """The portion of comment_line that identifies the part type. For shebang types, this
      is "#!". For all other types this is the same as comment_line. If None, there is
      no comment header associated with the part's MIME type."""
 
-  comment_line_included: bool = False
+  comment_line_included: bool
   """If True, the part is a shebang-style part, and the full shebang line is included
      as the first line in content; otherwise any identifying comment line has been stripped."""
 
-  headers: OrderedDict[str, str]
+  headers: Dict[str, str]
   """An ordered dictionary of MIME headers associated with the part. MIME-Version and
      Content-Type are explicitly removed from this mapping during construction."""
 
@@ -79,7 +204,8 @@ class CloudInitPart(CloudInitRenderable):
         self,
         content: CloudInitPartConvertible,
         mime_type: Optional[str]=None,
-        headers: MimeHeadersConvertible=None
+        headers: MimeHeadersConvertible=None,
+        prefer_json: bool=False
       ):
     """Create a container for a single part of a potentially multi-part cloud-init document
 
@@ -117,30 +243,37 @@ class CloudInitPart(CloudInitRenderable):
                             rendering is selected. If comment-header rendering is selected, the headers are
                             discarded. Defaults to None.
 
+        prefer_json (bool, optional):
+                            If True and content is a JsonableDict that will have MIME type "text/cloud-config",
+                            the dict is rendered as compact JSON rather than YAML. The JSON is adjusted where
+                            needed so that cloud-init's YAML 1.1 loader reads it back as the same data (content
+                            containing infinity or NaN is rendered as YAML). Rendering it is several times
+                            faster, but the output is less readable. Has no effect for other content or MIME
+                            types. Defaults to False.
+
     Raises:
         CloudInitGenError: An error occured building the part
     """
     if content is None:
       self.content = None
       self.mime_type = ''
-      self.headers = ordereddict()
+      self.mime_version = None
+      self.comment_line = None
+      self.comment_type = None
+      self.comment_line_included = False
+      self.headers = {}
     elif isinstance(content, CloudInitPart):
+      # All fields are immutable except headers, which gets its own copy
       self.content = content.content
       self.mime_type = content.mime_type
-      self.headers = ordereddict(content.headers)
+      self.mime_version = content.mime_version
+      self.comment_line = content.comment_line
+      self.comment_type = content.comment_type
+      self.comment_line_included = content.comment_line_included
+      self.headers = dict(content.headers)
     else:
       original_content = content
       is_yaml = isinstance(original_content, dict)
-      if is_yaml:
-        content = yaml.dump(
-            original_content,
-            sort_keys=True,
-            indent=1,
-            default_flow_style=None,
-            width=10000,
-          )
-      str_content = cast(str, content)   # Make mypy happy
-      mime_version: Optional[str] = None
       comment_line: Optional[str] = None
       comment_type: Optional[str] = None
       comment_line_included = False
@@ -149,53 +282,66 @@ class CloudInitPart(CloudInitRenderable):
         mime_type = merged_headers.pop('Content-Type', None)
       if mime_type is None and is_yaml:
         mime_type = 'text/cloud-config'   # For YAML docs we assume they are cloud-config unless explicitly other
+      if is_yaml:
+        jsonable_content = cast(JsonableDict, original_content)
+        if prefer_json and mime_type == 'text/cloud-config':
+          content = _json_dump(jsonable_content)
+        else:
+          content = _yaml_dump(jsonable_content)
+      str_content = cast(str, content)   # Make mypy happy
       if mime_type is None:
-        parts = str_content.split('\n', 1)
-        if len(parts) < 2:
-          raise CloudInitGenError(f"CloudInitPart has no mime type and content has no header line: {parts[0]}")
-        if parts[0].startswith('#'):
-          comment_line = parts[0]
-          comment_type = comment_line
-          if comment_type.startswith("#!"):
+        first_line, sep, rest = str_content.partition('\n')
+        if sep == '':
+          raise CloudInitGenError(f"CloudInitPart has no mime type and content has no header line: {first_line}")
+        if first_line.startswith('#'):
+          comment_line = first_line
+          part_type: Optional[CloudInitPartType]
+          if comment_line.startswith("#!"):
             comment_type = "#!"
-          part_type = comment_to_cloud_init_part_type.get(comment_type, None)
-          if part_type is None:
-            raise CloudInitGenError(f"Unrecognided CloudInitDoc comment tagline: {parts[0]}")
+            part_type = _SHEBANG_PART_TYPE
+          else:
+            comment_type = comment_line
+            part_type = comment_to_cloud_init_part_type.get(comment_type, None)
+            if part_type is None:
+              raise CloudInitGenError(f"Unrecognided CloudInitDoc comment tagline: {first_line}")
           mime_type = part_type.mime_type
           if comment_type == "#!":    # shebang comments must be left in the document even if mime is used
             comment_line_included = True
           else:
-            str_content = parts[1]
-        elif parts[0].startswith('MIME-Version:') or parts[0].startswith('Content-Type:'):
-          str_content, embedded_headers = cast(Tuple[str, OrderedDict[str, str]], self.extract_headers(str_content))
+            str_content = rest
+        elif first_line.startswith(('MIME-Version:', 'Content-Type:')):
+          str_content, embedded_headers = cast(Tuple[str, Dict[str, str]], self.extract_headers(str_content))
           mime_type = embedded_headers.pop('Content-Type')
           if mime_type is None:
             raise CloudInitGenError(f"CloudInitPart has Content-Type header: {embedded_headers}")
           merged_headers.update(embedded_headers)
         else:
-          raise CloudInitGenError(f"CloudInitPart has no mime type and first line of content does not identify type: {parts[0]}")
+          raise CloudInitGenError(f"CloudInitPart has no mime type and first line of content does not identify type: {first_line}")
           
-      if mime_type in [
-            'x-shellscript',
-            'x-shellscript-per-boot',
-            'x-shellscript-per-instance',
-            'x-shellscript-per-once' ]:
-        comment_type = "#!"
+      if mime_type in _SHELLSCRIPT_MIME_TYPES:
         if comment_line is None:
-          comment_line = str_content.split('\n', 1)[0]
+          # The MIME type came from an argument or a header, so the shebang line has not been
+          # found yet. Slice it off without copying the rest of the script as split() would.
+          newline_index = str_content.find('\n')
+          comment_line = str_content if newline_index < 0 else str_content[:newline_index]
         if not comment_line.startswith('#!'):
           raise CloudInitGenError(f"Content-Type \"{mime_type}\" requires shebang on first line of content: {comment_line}")
-        comment_line_included = True
+        if mime_type == 'text/x-shellscript':
+          # The shebang line doubles as the comment header, and is left in the content
+          comment_type = "#!"
+          comment_line_included = True
+        else:
+          # The other script types have no comment header, so they are always rendered with MIME headers
+          comment_line = None
       else:
         part_type = mime_to_cloud_init_part_type.get(mime_type, None)
         if not part_type is None:
           comment_type = part_type.comment_line
           comment_line = comment_type
 
-      mime_version = merged_headers.pop('MIME-Version', None)
       self.content = str_content
       self.mime_type = mime_type
-      self.mime_version = mime_version
+      self.mime_version = merged_headers.pop('MIME-Version', None)
       self.comment_type = comment_type
       self.comment_line = comment_line
       self.comment_line_included = comment_line_included
@@ -205,25 +351,37 @@ class CloudInitPart(CloudInitRenderable):
   def extract_headers(
         cls,
         content: Optional[str]
-      ) -> Tuple[Optional[str], OrderedDict[str, str]]:
+      ) -> Tuple[Optional[str], Dict[str, str]]:
     """Parses MIME headers and payload from a MIME document
 
     Args:
         content (Optional[str]): MIME document to be parsed, or None for a null document
 
     Returns:
-        Tuple[Optional[str], OrderedDict[str, str]]: A tuple containing:
+        Tuple[Optional[str], Dict[str, str]]: A tuple containing:
             [0]: The document payload, or None for a null document
-            [1]: an OrderedDict containing the headers. Empty for a null document.
+            [1]: an ordered dict containing the headers. Empty for a null document.
     """
     if content is None:
-      headers = ordereddict()
-    else:
-      parser = email.parser.Parser()
-      msg = parser.parsestr(content, headersonly=True)
-      content = msg.get_payload()
-      headers = ordereddict(msg)
-    return content, headers
+      return content, {}
+    # The email package is slow, and allocates many times the size of the document, so it is
+    # only used for documents that the simple splitter declines.
+    simple_result = _split_simple_mime_headers(content)
+    if simple_result is not None:
+      return simple_result
+    import email.parser   # Deferred; the email package is slow to import and rarely needed
+    parser = email.parser.Parser()
+    msg = parser.parsestr(content, headersonly=True)
+    payload = cast(str, msg.get_payload())
+    # Equivalent to dict(msg), but walks the message's header list once instead of
+    # rescanning it for every key. Like msg[name], the first occurrence of a header
+    # (ignoring case) provides its value.
+    items = msg.items()
+    first_values: Dict[str, str] = {}
+    for name, value in items:
+      first_values.setdefault(name.lower(), value)
+    headers = { name: first_values[name.lower()] for name, _ in items }
+    return payload, headers
 
   def is_null_content(self) -> bool:
     """Return True if this is a null document
@@ -263,19 +421,26 @@ class CloudInitPart(CloudInitRenderable):
                        this is a null part that should be stripped from final rendering.
     """
     result: Optional[str] = None
-    if not self.content is None:
-      if not force_mime and not self.comment_line is None:
-        result = ("" if self.comment_line_included else self.comment_line + '\n') + self.content
+    content = self.content
+    if not content is None:
+      comment_line = self.comment_line
+      if not force_mime and not comment_line is None:
+        if self.comment_line_included:
+          result = content
+        else:
+          result = f"{comment_line}\n{content}"
       else:
-        result = f"Content-Type: {self.mime_type}\n"
+        chunks: List[str] = [ f"Content-Type: {self.mime_type}\n" ]
+        append = chunks.append
         if include_mime_version:
-          mime_version = "1.0" if self.mime_version is None else self.mime_version
-          result += f"MIME-Version: {mime_version}\n"
+          mime_version = self.mime_version
+          append(f"MIME-Version: {'1.0' if mime_version is None else mime_version}\n")
         for k,v in self.headers.items():
           if include_from or k != 'From':
-            result += f"{k}: {v}\n"
-        result += '\n'
-        result += self.content
+            append(f"{k}: {v}\n")
+        append('\n')
+        append(content)
+        result = ''.join(chunks)
       #if result != '' and not result.endswith('\n'):
       #  result += '\n'
     return result
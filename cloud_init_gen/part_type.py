@@ -16,15 +16,17 @@ class CloudInitPartType:
   is used by the renderer to pick the optimal rendering of the part.
   """
 
+  __slots__ = ('mime_type', 'mime_subtype', 'comment_tag', 'comment_line')
+
   mime_type: str
   """The full MIME type; e.g., 'text/cloud-boothook'"""
   mime_subtype: str
 
-  comment_tag: Optional[str]=None
+  comment_tag: Optional[str]
   """The portion of comment_line after '#'. For '#!', this is just '!', and does not include the
      script commandline. If None, there is no comment header associated with the MIME type."""
 
-  comment_line: Optional[str]=None
+  comment_line: Optional[str]
   """The portion of the comment header that identifies its MIME type. For '#!', this is just '!#', and does not include the
      script commandline. If None, there is no comment header associated with the MIME type."""
 
@@ -61,8 +63,10 @@ _part_type_list: List[CloudInitPartType] = [
   ]
 """A list of MIME types that are pre-known to cloud-init"""
 
-mime_to_cloud_init_part_type: Dict[str, CloudInitPartType] = dict((x.mime_type, x) for x in _part_type_list)
+mime_to_cloud_init_part_type: Dict[str, CloudInitPartType] = { x.mime_type: x for x in _part_type_list }
 """A map from full MIME type to associated CloudInitPartType"""
 
-comment_to_cloud_init_part_type: Dict[str, CloudInitPartType] = dict((x.comment_line, x) for x in _part_type_list if not x.comment_line is None)
+comment_to_cloud_init_part_type: Dict[str, CloudInitPartType] = {
+    x.comment_line: x for x in _part_type_list if not x.comment_line is None
+  }
 """A map from comment header line (Just "#!" for shebang lines) to associated CloudInitPartType"""
@@ -14,6 +14,8 @@ from abc import ABC, abstractmethod
 class CloudInitRenderable(ABC):
   """Abstract base class for cloud-init renderable items"""
 
+  __slots__ = ()
+
   @abstractmethod
   def is_null_content(self) -> bool:
     """Return True if this is a null document
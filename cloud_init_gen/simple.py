@@ -12,6 +12,14 @@ from typing import Optional
 from .part import MimeHeadersConvertible
 from .cloud_init_doc import CloudInitDoc, CloudInitDocConvertible
 
+def _as_cloud_init_doc(content: CloudInitDocConvertible) -> CloudInitDoc:
+  """Returns content itself if it is a CloudInitDoc, otherwise a new CloudInitDoc built from it.
+
+  All of the render_cloud_init_* functions go through here, so a document that is passed
+  in is rendered directly rather than cloned first.
+  """
+  return content if isinstance(content, CloudInitDoc) else CloudInitDoc(content)
+
 def render_cloud_init_text(
       content: CloudInitDocConvertible
     ) -> Optional[str]:
@@ -35,7 +43,7 @@ def render_cloud_init_text(
       Optional[str]: The rendered cloud-init user-data document, as text, or None
                      if it is a null/empty document.
   """
-  cloud_init_doc = CloudInitDoc(content)
+  cloud_init_doc = _as_cloud_init_doc(content)
   # Note: include_mime_version is required by cloud-init for the top-level part,
   # so we don't even allow setting it to False.
   result = cloud_init_doc.render(include_mime_version=True)
@@ -64,7 +72,7 @@ def render_cloud_init_binary(
       Optional[bytes]: The rendered cloud-init user-data document, as a binary bytes blob, or None
                      if it is a null/empty document.
   """
-  cloud_init_doc = CloudInitDoc(content)
+  cloud_init_doc = _as_cloud_init_doc(content)
   # Note: include_mime_version is required by cloud-init for the top-level part,
   # so we don't even allow setting it to False.
   result = cloud_init_doc.render_binary(include_mime_version=True)
@@ -94,7 +102,7 @@ def render_cloud_init_base64(
       Optional[str]: The rendered cloud-init user-data document, as a binary blob encoded
                      into a base-64 string, or None if it is a null/empty document.
   """
-  cloud_init_doc = CloudInitDoc(content)
+  cloud_init_doc = _as_cloud_init_doc(content)
   # Note: include_mime_version is required by cloud-init for the top-level part,
   # so we don't even allow setting it to False.
   result = cloud_init_doc.render_base64(include_mime_version=True)
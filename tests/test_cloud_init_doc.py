@@ -0,0 +1,124 @@
+import base64
+import gzip
+import io
+
+import pytest
+
+from cloud_init_gen import CloudInitDoc, CloudInitPart, cloud_init_doc
+
+
+def test_clone_does_not_share_parts_list_held_by_caller():
+    d = CloudInitDoc('#!/bin/bash\necho one\n')
+    lst = d.parts
+    c = CloudInitDoc(d)
+    lst.append(CloudInitPart('#!/bin/bash\necho two\n'))
+    assert len(d.parts) == 2
+    assert len(c.parts) == 1
+
+
+def test_clone_does_not_share_assigned_parts_list():
+    d = CloudInitDoc()
+    mine = []
+    d.parts = mine
+    c = CloudInitDoc(d)
+    mine.append(CloudInitPart('#!/bin/bash\necho one\n'))
+    assert len(d.parts) == 1
+    assert len(c.parts) == 0
+
+
+def test_add_after_clone_is_independent():
+    d = CloudInitDoc('#!/bin/bash\necho one\n')
+    c = CloudInitDoc(d)
+    c.add('#cloud-config\na: 1\n')
+    d.add('#include\nhttp://example.com\n')
+    assert len(d.parts) == 2
+    assert len(c.parts) == 2
+    assert d.parts[1] is not c.parts[1]
+
+
+def _big_doc():
+    lines = ''.join('echo line %d\n' % i for i in range(2000))
+    return CloudInitDoc('#!/bin/bash\n' + lines)
+
+
+def _stdlib_gzip(data):
+    buf = io.BytesIO()
+    with gzip.GzipFile(filename='', mode='wb', compresslevel=9, fileobj=buf, mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def test_compression_defaults_to_stdlib_gzip():
+    d = _big_doc()
+    assert d.render_binary() == _stdlib_gzip(d.render().encode('utf-8'))
+
+
+def test_isal_is_opt_in(monkeypatch):
+    pytest.importorskip('isal')
+    d = _big_doc()
+    stdlib_binary = d.render_binary()
+    monkeypatch.setattr(cloud_init_doc, 'GZIP_USE_ISAL', True)
+    isal_binary = d.render_binary()
+    assert isal_binary != stdlib_binary
+    assert gzip.decompress(isal_binary) == d.render().encode('utf-8')
+    monkeypatch.setattr(cloud_init_doc, 'GZIP_USE_ISAL', False)
+    assert d.render_binary() == stdlib_binary
+
+
+def test_render_base64_bytes_matches_render_base64_small():
+    d = CloudInitDoc('#!/bin/bash\necho hi\n')
+    assert d.render_base64_bytes().decode('ascii') == d.render_base64()
+    assert base64.b64decode(d.render_base64_bytes()) == d.render_binary()
+
+
+def test_render_base64_bytes_matches_render_base64_compressed():
+    d = _big_doc()
+    assert len(d.render().encode('utf-8')) > 16383
+    assert d.render_base64_bytes().decode('ascii') == d.render_base64()
+    assert base64.b64decode(d.render_base64_bytes()) == d.render_binary()
+
+
+def test_render_base64_bytes_empty_doc_is_none():
+    d = CloudInitDoc()
+    assert d.render_base64_bytes() is None
+    assert d.render_base64() is None
+
+
+def test_prefer_json_passes_through_to_part():
+    cfg = {'a': 1e-05, 'b': ['x']}
+    d = CloudInitDoc(cfg, prefer_json=True)
+    d.add({'c': 1}, prefer_json=True)
+    d.add({'d': 2})
+    assert d.parts[0].content == '{"a":1.0e-05,"b":["x"]}\n'
+    assert d.parts[1].content == '{"c":1}\n'
+    assert d.parts[2].content == '{d: 2}\n'
+
+
+def test_compressed_cache_follows_gzip_fixed_mtime(monkeypatch):
+    d = _big_doc()
+    default_binary = d.render_binary()
+    monkeypatch.setattr(cloud_init_doc, 'GZIP_FIXED_MTIME', 12345.0)
+    changed_binary = d.render_binary()
+    assert changed_binary != default_binary
+    assert changed_binary == CloudInitDoc(d).render_binary()
+    assert gzip.decompress(changed_binary) == d.render().encode('utf-8')
+    monkeypatch.setattr(cloud_init_doc, 'GZIP_FIXED_MTIME', 0.0)
+    assert d.render_binary() == default_binary
+
+
+@pytest.mark.parametrize('texts, expected_boundary', [
+    (['a', 'b'], '::0::'),
+    (['::0::', 'b'], '::1::'),
+    (['::0::', ':::1::'], '::2::'),
+    (['::0::', '::01::'], '::1::'),
+    (['::0::', '::1::2::'], '::3::'),
+    (['::0:: ::01::', ':::1::', '::2::3::'], '::4::'),
+    (['::0::1', '::1', '::'], '::1::'),
+  ])
+def test_multipart_boundary_avoids_part_content(texts, expected_boundary):
+    d = CloudInitDoc()
+    for text in texts:
+        d.add('#!/bin/bash\necho "%s"\n' % text)
+    result = d.render()
+    assert result.startswith('Content-Type: multipart/mixed; boundary="%s"\n' % expected_boundary)
+    assert result.endswith('--%s--\n' % expected_boundary)
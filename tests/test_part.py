@@ -0,0 +1,95 @@
+import email.parser
+import math
+
+import pytest
+import yaml
+
+from cloud_init_gen import CloudInitDoc, CloudInitPart, CloudInitGenError
+from cloud_init_gen.part import _split_simple_mime_headers
+
+
+def test_prefer_json_round_trips_through_yaml():
+    cfg = {
+        'emoji': '\U0001F600 smile',
+        'next_line': 'a\x85b',
+        'delete': 'a\x7fb',
+        'escaped': '\\ud83d\\ude00 and \\\U0001F600',
+        '\U0001F680': ['\U00010000', '\U0010ffff'],
+        'floats': [1e-05, 1e+16, 1e+300, -2.5e-10, 1.7976931348623157e+308, 0.5, -0.0],
+        'float_text': 'x 1e-05 "1e+16"',
+      }
+    part = CloudInitPart(cfg, prefer_json=True)
+    assert part.content.startswith('{')
+    assert yaml.safe_load(part.content) == cfg
+
+
+def test_prefer_json_non_finite_floats_round_trip_through_yaml():
+    cfg = {'inf': float('inf'), 'ninf': [float('-inf')], 'nan': float('nan')}
+    part = CloudInitPart(cfg, prefer_json=True)
+    loaded = yaml.safe_load(part.content)
+    assert loaded['inf'] == float('inf')
+    assert loaded['ninf'] == [float('-inf')]
+    assert math.isnan(loaded['nan'])
+
+
+def test_shellscript_mime_type_renders_script_as_is():
+    script = '#!/bin/bash\necho hi\n'
+    part = CloudInitPart(script, mime_type='text/x-shellscript')
+    assert part.render() == script
+
+
+@pytest.mark.parametrize('mime_type', [
+    'text/x-shellscript',
+    'text/x-shellscript-per-boot',
+    'text/x-shellscript-per-instance',
+    'text/x-shellscript-per-once',
+  ])
+def test_shellscript_without_shebang_raises(mime_type):
+    with pytest.raises(CloudInitGenError):
+        CloudInitPart('echo hi\n', mime_type=mime_type)
+
+
+def test_cloned_shebang_part_keeps_comment_rendering():
+    script = '#!/bin/bash\necho hi\n'
+    part = CloudInitPart(script)
+    clone = CloudInitPart(part)
+    assert clone.render() == part.render() == script
+    assert clone.mime_type == part.mime_type
+    assert clone.headers is not part.headers
+    assert CloudInitDoc(clone).render() == script
+
+
+_MIME_DOCUMENTS = [
+    'Content-Type: text/x-shellscript\nX-Foo: bar\n\n#!/bin/bash\necho hi\n',
+    'X-Foo: a\n  b\n\tc\nX-Bar: d\n\npayload\n',
+    'X-A: 1\nx-a: 2\nX-A: 3\nX-B: 4\n\nbody',
+    'X-A: 1\nX-B: 2\nX-A: 3\n\nbody',
+    'X-A:1\nX-B:   spaced  \nX-C:\n\nbody\n\nmore\n',
+    'X-A: caf\u00e9\n\n\u00e9t\u00e9\n',
+    'X-A: 1\n\n',
+    'X-A: 1\r\nX-B: 2\r\n\r\nbody\r\n',
+    'X-A: 1\n',
+    'X-A: 1\nnot a header\n\nbody',
+    '\nbody\n',
+    ' folded first\n\nbody',
+    '#cloud-config\na: 1\n',
+    'From nobody\nX-A: 1\n\nbody',
+    'X A: 1\n\nbody',
+  ]
+
+
+def _email_parser_result(content):
+    msg = email.parser.Parser().parsestr(content, headersonly=True)
+    return msg.get_payload(), dict(msg)
+
+
+@pytest.mark.parametrize('content', _MIME_DOCUMENTS)
+def test_extract_headers_matches_email_parser(content):
+    expected = _email_parser_result(content)
+    simple_result = _split_simple_mime_headers(content)
+    if simple_result is not None:
+        assert simple_result == expected
+        assert list(simple_result[1]) == list(expected[1])
+    result = CloudInitPart.extract_headers(content)
+    assert result == expected
+    assert list(result[1]) == list(expected[1])